@@ -1,10 +1,18 @@
 import streamlit as st
-import requests
+import httpx
+import asyncio
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta, timezone
-import pytz
-import io
 import os
+import time
+from zoneinfo import ZoneInfo
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
 
 # --------------------------------------------------------
 # CONFIG
@@ -13,7 +21,12 @@ st.set_page_config(page_title="FanDuel NFL Odds Fetcher", layout="wide")
 
 SPORT = "americanfootball_nfl"
 REGION = "us"
+EASTERN_TZ = ZoneInfo("America/New_York")
 HOURS_AHEAD = 48
+PROGRESS_MIN_INTERVAL = 0.05  # seconds between progress bar redraws
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.3  # seconds, doubled on each retry
 MARKETS = [
     "player_pass_attempts",
     "player_pass_rush_yds",
@@ -28,17 +41,25 @@ MARKETS = [
     "player_reception_yds_alternate",
     "player_rush_yds_alternate",
 ]
+_MARKETS_CSV = ",".join(MARKETS)
+_ODDS_BASE = f"https://api.the-odds-api.com/v4/sports/{SPORT}"
 
 # --------------------------------------------------------
 # Helper: Load API key
 # --------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def _read_api_key(key_path, mtime):
+    # mtime is only part of the cache key, so editing key.txt invalidates it.
+    with open(key_path, "r") as f:
+        return f.read().strip()
+
+
 def load_api_key():
     key_path = "key.txt"
     if not os.path.exists(key_path):
         st.error("❌ Missing key.txt file. Please upload your Odds API key.")
         st.stop()
-    with open(key_path, "r") as f:
-        key = f.read().strip()
+    key = _read_api_key(key_path, os.path.getmtime(key_path))
     if not key:
         st.error("❌ key.txt is empty. Please add your Odds API key.")
         st.stop()
@@ -48,31 +69,44 @@ def load_api_key():
 # --------------------------------------------------------
 # Helper: Convert odds to American
 # --------------------------------------------------------
-def to_american_odds(odds_value):
-    try:
-        if isinstance(odds_value, int) or (isinstance(odds_value, float) and abs(odds_value) > 100):
-            return int(odds_value)
-        decimal_odds = float(odds_value)
-        if decimal_odds >= 2.0:
-            return int((decimal_odds - 1) * 100)
-        else:
-            return int(-100 / (decimal_odds - 1))
-    except Exception:
-        return None
+def _to_american_odds_array(prices):
+    # Decimal prices become American odds; values already past +/-100 are
+    # taken as American. Unparseable prices come back as NaN.
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        american = np.where(
+            np.abs(prices) > 100,
+            prices,
+            np.where(prices >= 2.0, (prices - 1) * 100, -100 / (prices - 1)),
+        )
+    american = np.trunc(american)
+    american[~np.isfinite(american)] = np.nan
+    return american
 
 
 # --------------------------------------------------------
 # Step 1 – Fetch upcoming NFL games (for selection)
 # --------------------------------------------------------
-def get_upcoming_games():
-    API_KEY = load_api_key()
-    events_url = f"https://api.the-odds-api.com/v4/sports/{SPORT}/events?apiKey={API_KEY}&regions={REGION}"
-
-    try:
-        events_resp = requests.get(events_url, timeout=15)
-    except requests.exceptions.RequestException as e:
-        st.error(f"🌐 Network error: {e}")
-        return []
+class OddsAPIError(Exception):
+    """Raised inside cached loaders so failures are shown but never memoized."""
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_events(api_key):
+    events_url = f"{_ODDS_BASE}/events?apiKey={api_key}&regions={REGION}"
+
+    # Same retry policy as the per-event fetches: connect failures are retried
+    # by the transport, 429/5xx responses by the backoff loop.
+    transport = httpx.HTTPTransport(retries=MAX_RETRIES)
+    with httpx.Client(timeout=15, transport=transport) as client:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                events_resp = client.get(events_url)
+            except httpx.HTTPError as e:
+                raise OddsAPIError(f"🌐 Network error: {e}")
+            if events_resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
 
     if events_resp.status_code != 200:
         try:
@@ -80,39 +114,50 @@ def get_upcoming_games():
             err_message = err_json.get("message", "Unknown API error")
         except Exception:
             err_message = events_resp.text
-        st.error(f"❌ API error {events_resp.status_code}: {err_message}")
-        return []
+        raise OddsAPIError(f"❌ API error {events_resp.status_code}: {err_message}")
 
     try:
-        events = events_resp.json()
+        events = _json_loads(events_resp.content)
     except Exception as e:
-        st.error(f"⚠️ Failed to parse API response: {e}")
-        return []
+        raise OddsAPIError(f"⚠️ Failed to parse API response: {e}")
 
-    now_utc = datetime.now(timezone.utc)
-    time_limit = now_utc + timedelta(hours=HOURS_AHEAD)
-    eastern_tz = pytz.timezone("US/Eastern")
+    # Kickoff times are parsed in one pass; malformed ones become NaT and drop out.
+    kickoffs = pd.to_datetime(
+        [e.get("commence_time") for e in events], utc=True, format="ISO8601", errors="coerce"
+    )
+    time_limit = pd.Timestamp.now(tz="UTC") + pd.Timedelta(hours=HOURS_AHEAD)
+    in_window = kickoffs <= time_limit
+
+    kickoffs_est = kickoffs.tz_convert(EASTERN_TZ)
+    dates_est = kickoffs_est.strftime("%m-%d-%Y")
+    times_est = kickoffs_est.strftime("%I:%M %p")
 
     games = []
-    for e in events:
+    for e, keep, date_est, time_est in zip(events, in_window, dates_est, times_est):
+        if not keep:
+            continue
         try:
-            # ✅ Parse kickoff time as UTC-aware
-            utc_dt = datetime.fromisoformat(e["commence_time"].replace("Z", "+00:00"))
-            utc_dt = utc_dt.replace(tzinfo=timezone.utc)
-
-            if utc_dt <= time_limit:
-                est_dt = utc_dt.astimezone(eastern_tz)
-                games.append({
-                    "id": e["id"],
-                    "game": f"{e['home_team']} vs {e['away_team']}",
-                    "date_est": est_dt.strftime("%m-%d-%Y"),
-                    "time_est": est_dt.strftime("%I:%M %p"),
-                    "datetime_est": est_dt.strftime("%m-%d-%Y %I:%M %p")
-                })
+            games.append({
+                "id": e["id"],
+                "game": f"{e['home_team']} vs {e['away_team']}",
+                "date_est": date_est,
+                "time_est": time_est,
+                "datetime_est": f"{date_est} {time_est}"
+            })
         except Exception as ex:
             print(f"Skipping event parse error: {ex}")
             continue
 
+    return games
+
+
+def get_upcoming_games(api_key):
+    try:
+        games = _load_events(api_key)
+    except OddsAPIError as e:
+        st.error(str(e))
+        return []
+
     if not games:
         st.warning("⚠️ No upcoming NFL games found in the next 48 hours. (Time conversion fixed — check key or API limits.)")
     return games
@@ -121,72 +166,145 @@ def get_upcoming_games():
 # --------------------------------------------------------
 # Step 2 – Fetch odds only for selected games
 # --------------------------------------------------------
-def fetch_odds(selected_games):
-    API_KEY = load_api_key()
-    all_props = []
-
-    progress = st.progress(0)
-    for idx, game in enumerate(selected_games):
-        event_id = game["id"]
-        event_name = game["game"]
-        date_est = game["date_est"]
-        time_est = game["time_est"]
-        formatted_est = game["datetime_est"]
+async def _fetch_one(client, url, game):
+    event_name = game["game"]
+    # Concurrent requests are the ones likely to be rate limited, so back off
+    # and retry 429/5xx before giving up on the event.
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = await client.get(url)
+        except httpx.HTTPError as e:
+            st.warning(f"⚠️ Network error fetching {event_name}: {e}")
+            return game, None
+        if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            break
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    # 422 means the event has no odds for these markets: an empty but
+    # successful result, unlike the None returned for failures.
+    if resp.status_code == 422:
+        return game, {}
+    if resp.status_code != 200:
+        try:
+            err_json = resp.json()
+            st.warning(f"⚠️ API {resp.status_code} for {event_name}: {err_json.get('message','Unknown error')}")
+        except Exception:
+            st.warning(f"⚠️ API {resp.status_code} for {event_name}: {resp.text}")
+        return game, None
 
+    try:
+        return game, _json_loads(resp.content)
+    except Exception as e:
+        st.warning(f"⚠️ Failed to parse odds for {event_name}: {e}")
+        return game, None
+
+
+async def _fetch_all(requests_to_make, progress):
+    # All per-event requests are in flight at once; results are slotted back
+    # into selection order so the output table stays stable.
+    results = [None] * len(requests_to_make)
+    limits = httpx.Limits(max_connections=16)
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=MAX_RETRIES)
+    async with httpx.AsyncClient(timeout=15, transport=transport) as client:
+
+        async def _indexed(idx, url, game):
+            # One event failing unexpectedly must not sink the other games.
+            try:
+                return idx, await _fetch_one(client, url, game)
+            except Exception as e:
+                st.warning(f"⚠️ Error fetching {game['game']}: {e}")
+                return idx, (game, None)
+
+        tasks = [_indexed(idx, url, game) for idx, (url, game) in enumerate(requests_to_make)]
+        last_update = 0.0
+        for done, next_result in enumerate(asyncio.as_completed(tasks), start=1):
+            idx, result = await next_result
+            results[idx] = result
+            # Each redraw is a websocket message; cap the rate but always show 100%.
+            now = time.monotonic()
+            if done == len(tasks) or now - last_update > PROGRESS_MIN_INTERVAL:
+                progress.progress(done / len(tasks))
+                last_update = now
+    return results
+
+
+def fetch_odds(selected_games, api_key):
+    # Returns (odds DataFrame, whether any per-event request failed).
+    requests_to_make = []
+    for game in selected_games:
         odds_url = (
-            f"https://api.the-odds-api.com/v4/sports/{SPORT}/events/{event_id}/odds/"
-            f"?apiKey={API_KEY}&regions={REGION}&markets={','.join(MARKETS)}"
+            f"{_ODDS_BASE}/events/{game['id']}/odds/"
+            f"?apiKey={api_key}&regions={REGION}&bookmakers=fanduel&markets={_MARKETS_CSV}"
         )
+        requests_to_make.append((odds_url, game))
 
-        try:
-            resp = requests.get(odds_url, timeout=15)
-            if resp.status_code == 422:
-                continue
-            if resp.status_code != 200:
-                try:
-                    err_json = resp.json()
-                    st.warning(f"⚠️ API {resp.status_code} for {event_name}: {err_json.get('message','Unknown error')}")
-                except Exception:
-                    st.warning(f"⚠️ API {resp.status_code} for {event_name}: {resp.text}")
-                continue
-            game_data = resp.json()
-        except requests.exceptions.RequestException as e:
-            st.warning(f"⚠️ Network error fetching {event_name}: {e}")
+    progress = st.progress(0)
+    results = asyncio.run(_fetch_all(requests_to_make, progress))
+    had_errors = any(game_data is None for _, game_data in results)
+
+    # One entry per market: scalar columns plus per-outcome arrays, stitched
+    # together into a single DataFrame at the end.
+    chunks = []
+    for game, game_data in results:
+        if game_data is None:
             continue
 
-        for bookmaker in game_data.get("bookmakers", []):
-            title = bookmaker.get("title", "").lower()
-            if "fanduel" not in title:
-                continue
+        # The request is scoped to bookmakers=fanduel; the key check is defensive.
+        # Fields the API always sends are indexed directly; only an outcome's
+        # description and point are optional.
+        bookmaker = next(
+            (b for b in game_data.get("bookmakers", []) if b["key"] == "fanduel"), None
+        )
+        if bookmaker is None:
+            continue
+        bookmaker_title = bookmaker["title"]
 
-            for market_item in bookmaker.get("markets", []):
-                market_key = market_item.get("key")
-                for outcome in market_item.get("outcomes", []):
-                    american_odds = to_american_odds(outcome.get("price"))
-                    all_props.append({
-                        "game": event_name,
-                        "date_time_est": formatted_est,
-                        "date_est": date_est,
-                        "time_est": time_est,
-                        "bookmaker": bookmaker.get("title"),
-                        "market": market_key,
-                        "player": outcome.get("description"),
-                        "over_under": outcome.get("point"),
-                        "side": outcome.get("name"),
-                        "odds_american": american_odds
-                    })
-
-        progress.progress((idx + 1) / len(selected_games))
-
-    df = pd.DataFrame(all_props)
-    if df.empty:
+        for market_item in bookmaker["markets"]:
+            # Only Over lines are exported, so Unders never enter the table.
+            outcomes = [o for o in market_item["outcomes"] if o["name"] == "Over"]
+            if not outcomes:
+                continue
+            chunks.append((
+                game,
+                bookmaker_title,
+                market_item["key"],
+                np.array([o.get("description") for o in outcomes], dtype=object),
+                np.array([o.get("point") for o in outcomes], dtype=np.float64),
+                np.array([o["price"] for o in outcomes], dtype=object),
+            ))
+
+    if not chunks:
         st.warning("⚠️ No FanDuel player prop odds available for selected games.")
-        return pd.DataFrame()
+        return pd.DataFrame(), had_errors
+
+    lengths = [len(chunk[3]) for chunk in chunks]
+
+    def _repeat(values):
+        return np.repeat(np.array(values, dtype=object), lengths)
+
+    df = pd.DataFrame({
+        "game": _repeat([c[0]["game"] for c in chunks]),
+        "date_time_est": _repeat([c[0]["datetime_est"] for c in chunks]),
+        "date_est": _repeat([c[0]["date_est"] for c in chunks]),
+        "time_est": _repeat([c[0]["time_est"] for c in chunks]),
+        "bookmaker": _repeat([c[1] for c in chunks]),
+        "market": _repeat([c[2] for c in chunks]),
+        "player": np.concatenate([c[3] for c in chunks]),
+        "over_under": np.concatenate([c[4] for c in chunks]),
+        "side": "Over",
+        "price": np.concatenate([c[5] for c in chunks]),
+    })
 
-    if "side" in df.columns:
-        df = df[df["side"] == "Over"]
+    # Raw prices are converted in one pass; anything non-numeric becomes <NA>.
+    prices = pd.to_numeric(df["price"], errors="coerce")
+    df["odds_american"] = pd.array(_to_american_odds_array(prices), dtype="Int64")
+    df = df.drop(columns="price")
 
-    return df
+    # These repeat once per game/market; category codes keep the table compact.
+    for col in ("game", "bookmaker", "market", "side", "date_est", "time_est", "date_time_est"):
+        df[col] = df[col].astype("category")
+
+    return df, had_errors
 
 
 # --------------------------------------------------------
@@ -198,7 +316,8 @@ st.divider()
 
 # Step 1: Show upcoming games
 st.header("📅 Select NFL Games to Fetch Odds For")
-games = get_upcoming_games()
+API_KEY = load_api_key()
+games = get_upcoming_games(API_KEY)
 
 if not games:
     st.stop()
@@ -219,20 +338,48 @@ selected_games = [g for g in games if g["game"] in selected_game_names]
 st.divider()
 
 # Step 2: Fetch odds for selected
-if st.button("🚀 **Fetch FanDuel Odds for Selected Games**", use_container_width=True, type="primary"):
+selection_key = tuple(sorted(g["id"] for g in selected_games))
+
+fetch_clicked = st.button("🚀 **Fetch FanDuel Odds for Selected Games**", use_container_width=True, type="primary")
+refresh_clicked = st.button(
+    "🔄 Force refresh",
+    use_container_width=True,
+    help="Re-fetch odds even if these games were already fetched this session."
+)
+
+if refresh_clicked:
+    for state_key in ("odds_df", "odds_df_key", "odds_had_errors"):
+        st.session_state.pop(state_key, None)
+
+if fetch_clicked or refresh_clicked:
     if not selected_games:
         st.warning("⚠️ Please select at least one game before fetching odds.")
         st.stop()
 
-    with st.spinner("Fetching FanDuel player prop odds..."):
-        df = fetch_odds(selected_games)
+    # Results survive reruns, so the same selection never re-spends API credits.
+    # Partial or empty results are still shown, but Fetch retries them.
+    have_complete = (
+        st.session_state.get("odds_df_key") == selection_key
+        and not st.session_state["odds_had_errors"]
+        and not st.session_state["odds_df"].empty
+    )
+    if not have_complete:
+        with st.spinner("Fetching FanDuel player prop odds..."):
+            df, had_errors = fetch_odds(selected_games, API_KEY)
+        st.session_state["odds_df"] = df
+        st.session_state["odds_df_key"] = selection_key
+        st.session_state["odds_had_errors"] = had_errors
+
+if selection_key and st.session_state.get("odds_df_key") == selection_key:
+    df = st.session_state["odds_df"]
+    if st.session_state["odds_had_errors"]:
+        st.warning("⚠️ Some games failed to fetch, so these results are partial. Click 🔄 Force refresh to retry.")
 
     if not df.empty:
         st.success(f"✅ Retrieved {len(df)} odds entries across {len(selected_games)} selected games.")
         st.dataframe(df.head(25), use_container_width=True)
 
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
+        csv_data = df.to_csv(index=False)
 
         # 🔴 Red styled download button
         red_button_style = """
@@ -254,7 +401,7 @@ if st.button("🚀 **Fetch FanDuel Odds for Selected Games**", use_container_wid
         st.markdown(red_button_style, unsafe_allow_html=True)
         st.download_button(
             label="⬇️ Download odds.csv",
-            data=csv_buffer.getvalue(),
+            data=csv_data,
             file_name="odds.csv",
             mime="text/csv",
             use_container_width=True